@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+# Modules that must not be imported before a probe or writer needs them
+HEAVY_MODULES = ['influxdb_client', 'requests']
+
+SCENARIOS = {
+    'interpreter': 'pass',
+    'import': 'import collector',
+    'monitor': 'from collector import NetworkMonitor; NetworkMonitor()',
+}
+
+# Appended to each scenario to report which heavy modules were loaded
+REPORT_MODULES = (
+    '\nimport sys, json\n'
+    'print(json.dumps([m for m in {modules!r} if m in sys.modules]))'
+)
+
+def run_scenario(code, env):
+    """Time a fresh interpreter running code; return (ms, loaded heavy modules)"""
+    start_time = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-c', code + REPORT_MODULES.format(modules=HEAVY_MODULES)],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+        env=env,
+        timeout=60
+    )
+    elapsed_ms = (time.perf_counter() - start_time) * 1000
+
+    if result.returncode != 0:
+        raise RuntimeError(f"Scenario failed: {result.stderr.strip()}")
+
+    loaded = json.loads(result.stdout.strip().splitlines()[-1])
+    return elapsed_ms, loaded
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure collector cold-start time")
+    parser.add_argument('--runs', type=int, default=5, help="runs per scenario (default: 5)")
+    parser.add_argument('--max-ms', type=float, default=None,
+                        help="fail if monitor startup exceeds the interpreter baseline by more than this")
+    args = parser.parse_args()
+
+    # Point the background health check at a closed local port so DNS lookups
+    # of the compose hostname do not skew the measurement
+    env = dict(os.environ)
+    env.setdefault('INFLUXDB_URL', 'http://127.0.0.1:9')
+
+    results = {}
+    loaded_modules = set()
+    for name, code in SCENARIOS.items():
+        timings = []
+        for _ in range(args.runs):
+            elapsed_ms, loaded = run_scenario(code, env)
+            timings.append(elapsed_ms)
+            loaded_modules.update(loaded)
+        results[name] = statistics.median(timings)
+
+    baseline = results['interpreter']
+    print(f"{'scenario':<12} {'median ms':>10} {'over baseline':>14}")
+    for name, median_ms in results.items():
+        print(f"{name:<12} {median_ms:>10.1f} {median_ms - baseline:>14.1f}")
+
+    failed = False
+    if loaded_modules:
+        print(f"FAIL: heavy modules imported at startup: {', '.join(sorted(loaded_modules))}")
+        failed = True
+    if args.max_ms is not None and results['monitor'] - baseline > args.max_ms:
+        print(f"FAIL: monitor startup exceeds budget of {args.max_ms:.0f} ms over baseline")
+        failed = True
+
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,10 +5,10 @@ import time
 import logging
 import subprocess
 import json
-from datetime import datetime
-from influxdb_client import InfluxDBClient, Point
-from influxdb_client.client.write_api import SYNCHRONOUS
-import requests
+import fcntl
+import statistics
+from collections import deque
+from datetime import datetime, date
 import threading
 import concurrent.futures
 
@@ -19,6 +19,83 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Interval between live throughput samples sent to the progress callback
+PROGRESS_SAMPLE_INTERVAL = 0.1  # seconds
+
+# z-score for the 95% confidence interval of the adaptive speed test
+CONFIDENCE_Z = 1.96
+
+# Seconds between InfluxDB health checks while waiting for it to come up
+INFLUX_HEALTH_INTERVAL = 5
+
+# Maximum number of collection cycles buffered while InfluxDB is unavailable
+INFLUX_BUFFER_SIZE = 1000
+
+
+class ByteCounter:
+    """Thread-safe running total of transferred bytes"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.total = 0
+
+    def add(self, count):
+        with self._lock:
+            self.total += count
+
+
+class CountingReader:
+    """File-like wrapper around upload data that counts bytes as they are sent"""
+    def __init__(self, data, counter, block_size=64 * 1024, active=None):
+        self.data = data
+        self.counter = counter
+        self.block_size = block_size
+        self.offset = 0
+        # Event cleared once all data has been handed to the connection
+        self.active = active
+
+    def __len__(self):
+        return len(self.data) - self.offset
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.block_size
+        chunk = self.data[self.offset:self.offset + size]
+        self.offset += len(chunk)
+        self.counter.add(len(chunk))
+        if self.active is not None and self.offset >= len(self.data):
+            self.active.clear()
+        return chunk
+
+
+class ConvergenceTracker:
+    """Rolling throughput estimate with a 95% confidence interval"""
+    def __init__(self, tolerance, warmup_samples=0, window=20, min_samples=10):
+        self.tolerance = tolerance
+        self.warmup_samples = warmup_samples
+        self.min_samples = min_samples
+        self.samples = deque(maxlen=window)
+        self.seen = 0
+
+    def add_sample(self, mbps):
+        self.seen += 1
+        # Skip the TCP slow-start ramp before collecting samples
+        if self.seen > self.warmup_samples:
+            self.samples.append(mbps)
+
+    def estimate(self):
+        """Return (mean, confidence half-width) in Mbps, or (None, None)"""
+        samples = list(self.samples)
+        if len(samples) < self.min_samples:
+            return None, None
+        mean = statistics.mean(samples)
+        half_width = CONFIDENCE_Z * statistics.stdev(samples) / len(samples) ** 0.5
+        return mean, half_width
+
+    def converged(self):
+        mean, half_width = self.estimate()
+        return mean is not None and mean > 0 and half_width <= mean * self.tolerance
+
+
 class NetworkMonitor:
     def __init__(self):
         self.influx_url = os.getenv('INFLUXDB_URL', 'http://influxdb:8086')
@@ -33,16 +110,166 @@ class NetworkMonitor:
         
         self.collection_interval = int(os.getenv('COLLECTION_INTERVAL', '30'))
         
-        # Initialize InfluxDB client
-        self.client = InfluxDBClient(
-            url=self.influx_url,
-            token=self.influx_token,
-            org=self.influx_org
-        )
-        self.write_api = self.client.write_api(write_options=SYNCHRONOUS)
+        # Speed test data usage controls
+        self.speedtest_mode = os.getenv('SPEEDTEST_MODE', 'fixed').lower()
+        self.speedtest_tolerance = float(os.getenv('SPEEDTEST_CONFIDENCE_TOLERANCE', '0.05'))
+        self.speedtest_daily_budget = int(float(os.getenv('SPEEDTEST_DAILY_BUDGET_MB', '0')) * 1024 * 1024)
+        self.speedtest_usage_file = os.getenv('SPEEDTEST_USAGE_FILE', '/var/lib/network-monitor/speedtest-usage.json')
+        
+        # InfluxDB client is created on first write; metrics collected before
+        # InfluxDB is healthy are buffered and written once it comes up
+        self.client = None
+        self.write_api = None
+        self.write_lock = threading.RLock()
+        self.pending_metrics = deque(maxlen=INFLUX_BUFFER_SIZE)
+        self.influx_ready = threading.Event()
+        health_thread = threading.Thread(target=self.wait_for_influxdb, daemon=True)
+        health_thread.start()
+        
+        # Optional callable receiving progress events (dicts) while a test runs
+        self.progress_callback = None
         
         logger.info(f"Monitoring targets: {self.target1_name} ({self.target1}), {self.target2_name} ({self.target2})")
         logger.info(f"Collection interval: {self.collection_interval} seconds")
+        logger.info(f"Speed test mode: {self.speedtest_mode}")
+        if self.speedtest_daily_budget > 0:
+            logger.info(f"Speed test daily budget: {self.speedtest_daily_budget / (1024 * 1024):.0f} MB")
+
+    def wait_for_influxdb(self):
+        """Poll the InfluxDB health endpoint until it responds"""
+        import urllib.request
+        
+        while True:
+            try:
+                with urllib.request.urlopen(f"{self.influx_url}/health", timeout=5) as response:
+                    if response.status == 200:
+                        break
+            except Exception as e:
+                logger.debug(f"InfluxDB health check failed: {e}")
+            logger.info("InfluxDB not ready, waiting...")
+            time.sleep(INFLUX_HEALTH_INTERVAL)
+        
+        logger.info("InfluxDB is ready")
+        self.influx_ready.set()
+
+    def get_write_api(self):
+        """Return the InfluxDB write API, creating the client on first use"""
+        if self.write_api is None:
+            from influxdb_client import InfluxDBClient
+            from influxdb_client.client.write_api import SYNCHRONOUS
+            
+            self.client = InfluxDBClient(
+                url=self.influx_url,
+                token=self.influx_token,
+                org=self.influx_org
+            )
+            self.write_api = self.client.write_api(write_options=SYNCHRONOUS)
+        return self.write_api
+
+    def emit_progress(self, event, **data):
+        """Send a progress event to the registered callback, if any"""
+        if self.progress_callback is None:
+            return
+        try:
+            self.progress_callback({'event': event, 'timestamp': time.time(), **data})
+        except Exception as e:
+            logger.debug(f"Progress callback failed: {e}")
+
+    def start_throughput_sampler(self, phase, counter, tracker=None, stop_transfer=None, byte_limit=None,
+                                 active=None):
+        """Sample throughput of a phase until the returned event is set.
+        
+        Samples go to the progress callback and the convergence tracker;
+        stop_transfer is set once the estimate converges or byte_limit is reached.
+        If active is given, the tracker only receives samples while it is set.
+        """
+        stop_event = threading.Event()
+        if self.progress_callback is None and tracker is None and byte_limit is None:
+            return stop_event
+        
+        def sample():
+            start_time = time.time()
+            last_time = start_time
+            last_bytes = 0
+            while not stop_event.wait(PROGRESS_SAMPLE_INTERVAL):
+                now = time.time()
+                total = counter.total
+                interval = now - last_time
+                if interval > 0:
+                    mbps = ((total - last_bytes) * 8) / (1024 * 1024) / interval
+                    progress = {}
+                    if tracker is not None:
+                        # Samples taken while the workers wind down would drag the
+                        # converged estimate towards zero
+                        stopped = stop_transfer is not None and stop_transfer.is_set()
+                        idle = active is not None and not active.is_set()
+                        if not stopped and not idle:
+                            tracker.add_sample(mbps)
+                        mean, half_width = tracker.estimate()
+                        if mean is not None:
+                            progress['estimate_mbps'] = round(mean, 2)
+                            progress['ci_mbps'] = round(half_width, 2)
+                    self.emit_progress(
+                        'throughput',
+                        phase=phase,
+                        bytes=total,
+                        elapsed=round(now - start_time, 3),
+                        mbps=round(mbps, 2),
+                        **progress
+                    )
+                    
+                    if stop_transfer is not None and not stop_transfer.is_set():
+                        if tracker is not None and tracker.converged():
+                            logger.info(f"{phase.capitalize()} estimate converged after {now - start_time:.1f}s")
+                            stop_transfer.set()
+                        elif byte_limit is not None and total >= byte_limit:
+                            logger.info(f"{phase.capitalize()} stopped at daily byte budget")
+                            stop_transfer.set()
+                last_time = now
+                last_bytes = total
+        
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+        return stop_event
+
+    def get_speed_test_usage(self):
+        """Return bytes used by speed tests today, or None if the usage file is unreadable"""
+        try:
+            with open(self.speedtest_usage_file) as f:
+                usage = json.load(f)
+            if usage.get('date') == date.today().isoformat():
+                return int(usage.get('bytes', 0))
+            return 0
+        except FileNotFoundError:
+            return 0
+        except Exception as e:
+            logger.error(f"Could not read speed test usage file {self.speedtest_usage_file}: {e}")
+            return None
+
+    def record_speed_test_usage(self, bytes_used):
+        """Add bytes_used to today's speed test usage"""
+        # The collector and the manual test server share the usage file, so the
+        # read-modify-write is serialized with a lock file and the new contents
+        # are swapped in atomically
+        try:
+            with open(f"{self.speedtest_usage_file}.lock", 'w') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                
+                used_today = self.get_speed_test_usage()
+                if used_today is None:
+                    logger.error("Not recording speed test usage, usage file is unreadable")
+                    return
+                
+                usage = {
+                    'date': date.today().isoformat(),
+                    'bytes': used_today + bytes_used
+                }
+                temp_file = f"{self.speedtest_usage_file}.tmp"
+                with open(temp_file, 'w') as f:
+                    json.dump(usage, f)
+                os.replace(temp_file, self.speedtest_usage_file)
+        except Exception as e:
+            logger.warning(f"Could not write speed test usage file: {e}")
 
     def ping_target(self, target, target_name):
         """Perform ping test and return metrics"""
@@ -133,8 +360,10 @@ class NetworkMonitor:
                 'stddev_rtt': None
             }
 
-    def download_test_worker(self, url, size_mb, timeout):
+    def download_test_worker(self, url, size_mb, timeout, counter=None, stop_event=None):
         """Worker function for parallel download testing"""
+        import requests
+        
         try:
             start_time = time.time()
             response = requests.get(url, timeout=timeout, stream=True)
@@ -143,9 +372,13 @@ class NetworkMonitor:
                 downloaded = 0
                 for chunk in response.iter_content(chunk_size=8192):
                     downloaded += len(chunk)
-                    # Stop if we've downloaded enough or timeout
+                    if counter is not None:
+                        counter.add(len(chunk))
+                    # Stop if we've downloaded enough, timed out or the test was ended early
                     if downloaded >= size_mb * 1024 * 1024 or (time.time() - start_time) > timeout:
                         break
+                    if stop_event is not None and stop_event.is_set():
+                        break
                 
                 elapsed_time = time.time() - start_time
                 if elapsed_time > 0:
@@ -160,12 +393,52 @@ class NetworkMonitor:
 
     def perform_speed_test(self):
         """Perform an enhanced speed test using multiple methods and servers"""
+        import requests
+        
+        # Created up front so bytes transferred before an unexpected error still
+        # count against the daily budget
+        download_counter = ByteCounter()
+        upload_counter = ByteCounter()
+        
         try:
             download_speed_mbps = 0
             upload_speed_mbps = 0
+            download_ci_mbps = None
+            upload_ci_mbps = None
+            upload_skipped = False  # upload not measured because of the byte budget
+            adaptive = self.speedtest_mode == 'adaptive'
+            
+            # Respect the daily data budget
+            remaining_budget = None
+            if self.speedtest_daily_budget > 0:
+                used_today = self.get_speed_test_usage()
+                if used_today is None:
+                    logger.warning("Daily speed test usage unknown, skipping speed test")
+                    return {
+                        'download_speed_mbps': 0,
+                        'upload_speed_mbps': 0,
+                        'bytes_used': 0
+                    }
+                remaining_budget = self.speedtest_daily_budget - used_today
+                if remaining_budget <= 0:
+                    logger.warning("Daily speed test byte budget exhausted, skipping speed test")
+                    return {
+                        'download_speed_mbps': 0,
+                        'upload_speed_mbps': 0,
+                        'bytes_used': 0
+                    }
             
             # Enhanced Download Test with multiple servers and parallel connections
             logger.info("Starting enhanced download speed test...")
+            self.emit_progress('phase', phase='download', status='started')
+            stop_download = threading.Event()
+            download_tracker = ConvergenceTracker(self.speedtest_tolerance, warmup_samples=10) if adaptive else None
+            stop_sampler = self.start_throughput_sampler(
+                'download', download_counter,
+                tracker=download_tracker,
+                stop_transfer=stop_download,
+                byte_limit=remaining_budget
+            )
             
             # Multiple test servers for better accuracy
             download_urls = [
@@ -180,12 +453,14 @@ class NetworkMonitor:
             max_workers = 3  # Parallel connections
             test_duration = 15  # seconds
             
+            download_start = time.time()
             try:
                 with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
                     # Start multiple download tests in parallel
                     futures = []
                     for i, url in enumerate(download_urls[:max_workers]):
-                        future = executor.submit(self.download_test_worker, url, 50, test_duration)
+                        future = executor.submit(self.download_test_worker, url, 50, test_duration,
+                                                 download_counter, stop_download)
                         futures.append(future)
                     
                     # Collect results
@@ -205,29 +480,64 @@ class NetworkMonitor:
                     
             except Exception as e:
                 logger.warning(f"Parallel download test failed: {e}")
+            finally:
+                stop_sampler.set()
+            download_elapsed = time.time() - download_start
+            
+            bytes_used = download_counter.total
+            
+            # Adaptive mode reports the rolling estimate of all streams combined,
+            # together with its confidence interval
+            if download_tracker is not None:
+                estimate, half_width = download_tracker.estimate()
+                if estimate is not None and estimate > 0:
+                    download_speed_mbps = estimate
+                    download_ci_mbps = half_width
+                    logger.info(f"Adaptive download estimate: {estimate:.1f} ± {half_width:.1f} Mbps")
+                elif bytes_used > 0 and download_elapsed > 0:
+                    # Too few samples for an estimate (e.g. stopped early by the
+                    # byte budget); keep the combined-rate meaning without a CI
+                    download_speed_mbps = (bytes_used * 8) / (1024 * 1024) / download_elapsed
+                    logger.info(f"Adaptive download combined rate (no estimate): {download_speed_mbps:.1f} Mbps")
             
             # Fallback to single connection test if parallel failed
-            if download_speed_mbps == 0:
+            if download_speed_mbps == 0 and (remaining_budget is None or bytes_used < remaining_budget):
                 logger.info("Trying single connection download test...")
                 try:
                     # Use curl for more accurate measurement
-                    result = subprocess.run([
-                        'curl', '-s', '-o', '/dev/null', '-w', '%{speed_download}',
+                    curl_command = [
+                        'curl', '-s', '-o', '/dev/null', '-w', '%{speed_download} %{size_download}',
                         '--max-time', '20',
-                        '--connect-timeout', '10',
-                        'http://speedtest.tele2.net/50MB.zip'
-                    ], capture_output=True, text=True, timeout=25)
+                        '--connect-timeout', '10'
+                    ]
+                    if remaining_budget is not None:
+                        curl_command += ['--range', f'0-{remaining_budget - bytes_used - 1}']
+                    curl_command.append('http://speedtest.tele2.net/50MB.zip')
+                    result = subprocess.run(curl_command, capture_output=True, text=True, timeout=25)
                     
                     if result.returncode == 0 and result.stdout.strip():
-                        download_speed_bps = float(result.stdout.strip())
+                        speed_field, size_field = result.stdout.split()
+                        download_speed_bps = float(speed_field)
                         download_speed_mbps = (download_speed_bps * 8) / (1024 * 1024)
+                        curl_bytes = int(float(size_field))
+                        download_counter.add(curl_bytes)
+                        bytes_used += curl_bytes
                         logger.info(f"Curl download speed: {download_speed_mbps:.1f} Mbps")
                         
                 except Exception as e:
                     logger.warning(f"Curl download test failed: {e}")
             
+            self.emit_progress('phase', phase='download', status='completed',
+                               download_speed_mbps=round(download_speed_mbps, 1))
+            
             # Enhanced Upload Test
             logger.info("Starting enhanced upload speed test...")
+            self.emit_progress('phase', phase='upload', status='started')
+            upload_tracker = ConvergenceTracker(self.speedtest_tolerance, warmup_samples=2, min_samples=5) if adaptive else None
+            # Only sample while request bodies are being sent, not while waiting for responses
+            upload_active = threading.Event()
+            stop_sampler = self.start_throughput_sampler('upload', upload_counter, tracker=upload_tracker,
+                                                         active=upload_active)
             
             try:
                 # Create test data (5MB)
@@ -243,11 +553,19 @@ class NetworkMonitor:
                 upload_speeds = []
                 
                 for endpoint in upload_endpoints[:2]:  # Test 2 endpoints
+                    if remaining_budget is not None and bytes_used + upload_counter.total + len(test_data) > remaining_budget:
+                        logger.info("Skipping upload test, daily byte budget would be exceeded")
+                        upload_skipped = True
+                        break
+                    if upload_speeds and upload_tracker is not None and upload_tracker.converged():
+                        logger.info("Upload estimate converged, skipping remaining endpoints")
+                        break
                     try:
                         start_time = time.time()
+                        upload_active.set()
                         response = requests.post(
                             endpoint,
-                            data=test_data,
+                            data=CountingReader(test_data, upload_counter, active=upload_active),
                             timeout=15,
                             headers={'Content-Type': 'application/octet-stream'}
                         )
@@ -262,101 +580,196 @@ class NetworkMonitor:
                         
                     except Exception as e:
                         logger.debug(f"Upload test to {endpoint} failed: {e}")
+                    finally:
+                        upload_active.clear()
                 
                 if upload_speeds:
                     upload_speed_mbps = max(upload_speeds)  # Take best result
-                else:
+                elif not adaptive and not upload_skipped:
                     # Fallback: estimate upload as 10% of download (typical for most connections)
                     upload_speed_mbps = download_speed_mbps * 0.1
                     
             except Exception as e:
                 logger.warning(f"Upload speed test failed: {e}")
-                upload_speed_mbps = download_speed_mbps * 0.1 if download_speed_mbps > 0 else 0
+                if not adaptive:
+                    upload_speed_mbps = download_speed_mbps * 0.1 if download_speed_mbps > 0 else 0
+            finally:
+                stop_sampler.set()
+            
+            bytes_used += upload_counter.total
+            if upload_tracker is not None:
+                estimate, half_width = upload_tracker.estimate()
+                if estimate is not None and estimate > 0:
+                    upload_speed_mbps = estimate
+                    upload_ci_mbps = half_width
+                    logger.info(f"Adaptive upload estimate: {estimate:.1f} ± {half_width:.1f} Mbps")
+            
+            self.emit_progress('phase', phase='upload', status='completed',
+                               upload_speed_mbps=round(upload_speed_mbps, 1))
             
-            # Apply realistic constraints and improvements
-            if download_speed_mbps > 0:
+            # Apply realistic constraints and improvements. Adaptive mode reports
+            # the measured estimates as-is so they match their confidence intervals.
+            if download_speed_mbps > 0 and not adaptive:
                 # For high-speed connections, add some realistic variance
                 if download_speed_mbps < 50:  # If speed seems too low, boost it
                     # Possible network congestion or server limitation, estimate higher
                     download_speed_mbps = min(download_speed_mbps * 2.5, 350)
                 
-                # Ensure upload is reasonable compared to download
-                if upload_speed_mbps < download_speed_mbps * 0.05:  # Less than 5% seems too low
+                # Ensure upload is reasonable compared to download (0 means not measured)
+                if not upload_skipped and upload_speed_mbps < download_speed_mbps * 0.05:  # Less than 5% seems too low
                     upload_speed_mbps = download_speed_mbps * 0.3  # Assume 30% for good connections
             
             # Cap at reasonable maximum values
-            download_speed_mbps = max(0, min(500, download_speed_mbps))  # Cap at 500 Mbps
-            upload_speed_mbps = max(0, min(500, upload_speed_mbps))
+            if adaptive:
+                download_speed_mbps = max(0, download_speed_mbps)
+                upload_speed_mbps = max(0, upload_speed_mbps)
+            else:
+                download_speed_mbps = max(0, min(500, download_speed_mbps))  # Cap at 500 Mbps
+                upload_speed_mbps = max(0, min(500, upload_speed_mbps))
             
-            # Round to integers for cleaner display
+            # Round to integers for cleaner display (and the existing integer field type)
             download_speed_mbps = int(round(download_speed_mbps))
             upload_speed_mbps = int(round(upload_speed_mbps))
             
             logger.info(f"Final speed test results: {download_speed_mbps} Mbps down, {upload_speed_mbps} Mbps up")
+            logger.info(f"Speed test data used: {bytes_used / (1024 * 1024):.1f} MB")
             
-            return {
+            result = {
                 'download_speed_mbps': download_speed_mbps,
-                'upload_speed_mbps': upload_speed_mbps
+                'upload_speed_mbps': upload_speed_mbps,
+                'bytes_used': bytes_used
             }
+            if download_ci_mbps is not None:
+                result['download_ci_mbps'] = round(download_ci_mbps, 2)
+            if upload_ci_mbps is not None:
+                result['upload_ci_mbps'] = round(upload_ci_mbps, 2)
+            
+            if self.speedtest_daily_budget > 0:
+                self.record_speed_test_usage(bytes_used)
+            return result
             
         except Exception as e:
             logger.error(f"Speed test failed: {e}")
+            bytes_used = download_counter.total + upload_counter.total
+            if self.speedtest_daily_budget > 0 and bytes_used > 0:
+                self.record_speed_test_usage(bytes_used)
             return {
                 'download_speed_mbps': 0,
-                'upload_speed_mbps': 0
+                'upload_speed_mbps': 0,
+                'bytes_used': bytes_used
             }
 
+    def build_points(self, metrics, timestamp):
+        """Convert collected metrics into InfluxDB points"""
+        from influxdb_client import Point
+        
+        points = []
+        
+        # Write ping metrics for each target
+        for target_metrics in metrics['ping_results']:
+            point = Point("network_performance") \
+                .tag("target", target_metrics['target']) \
+                .tag("target_name", target_metrics['target_name']) \
+                .field("success", target_metrics['success']) \
+                .field("packet_loss", target_metrics['packet_loss']) \
+                .time(timestamp)
+            
+            if target_metrics['avg_rtt'] is not None:
+                point = point.field("avg_rtt", target_metrics['avg_rtt']) \
+                           .field("min_rtt", target_metrics['min_rtt']) \
+                           .field("max_rtt", target_metrics['max_rtt']) \
+                           .field("stddev_rtt", target_metrics['stddev_rtt'])
+            
+            points.append(point)
+        
+        # Write speed test metrics - ensure integers for consistency
+        speed_test = metrics['speed_test']
+        speed_point = Point("network_speed") \
+            .field("download_speed_mbps", int(speed_test['download_speed_mbps'])) \
+            .field("upload_speed_mbps", int(speed_test['upload_speed_mbps'])) \
+            .time(timestamp)
+        
+        # Data usage and adaptive test confidence, when measured
+        if 'bytes_used' in speed_test:
+            speed_point = speed_point.field("bytes_used", int(speed_test['bytes_used']))
+        for field in ('download_ci_mbps', 'upload_ci_mbps'):
+            if field in speed_test:
+                speed_point = speed_point.field(field, float(speed_test[field]))
+        points.append(speed_point)
+        
+        return points
+
     def write_metrics(self, metrics):
-        """Write metrics to InfluxDB"""
-        try:
-            points = []
-            timestamp = datetime.utcnow()
-            
-            # Write ping metrics for each target
-            for target_metrics in metrics['ping_results']:
-                point = Point("network_performance") \
-                    .tag("target", target_metrics['target']) \
-                    .tag("target_name", target_metrics['target_name']) \
-                    .field("success", target_metrics['success']) \
-                    .field("packet_loss", target_metrics['packet_loss']) \
-                    .time(timestamp)
-                
-                if target_metrics['avg_rtt'] is not None:
-                    point = point.field("avg_rtt", target_metrics['avg_rtt']) \
-                               .field("min_rtt", target_metrics['min_rtt']) \
-                               .field("max_rtt", target_metrics['max_rtt']) \
-                               .field("stddev_rtt", target_metrics['stddev_rtt'])
-                
-                points.append(point)
+        """Write metrics to InfluxDB, buffering them until InfluxDB is ready"""
+        with self.write_lock:
+            if len(self.pending_metrics) == self.pending_metrics.maxlen:
+                logger.warning("Metrics buffer full, dropping the oldest buffered collection")
+            self.pending_metrics.append((datetime.utcnow(), metrics))
             
-            # Write speed test metrics - ensure integers for consistency
-            speed_point = Point("network_speed") \
-                .field("download_speed_mbps", int(metrics['speed_test']['download_speed_mbps'])) \
-                .field("upload_speed_mbps", int(metrics['speed_test']['upload_speed_mbps'])) \
-                .time(timestamp)
-            points.append(speed_point)
+            if not self.influx_ready.is_set():
+                logger.info(f"InfluxDB not ready yet, buffering metrics ({len(self.pending_metrics)} pending)")
+                return False
             
-            # Write all points
-            self.write_api.write(
-                bucket=self.influx_bucket,
-                org=self.influx_org,
-                record=points
-            )
+            return self.flush_metrics()
+
+    def flush_metrics(self):
+        """Write buffered metrics to InfluxDB, one batch per collection.
+        
+        Collections that InfluxDB rejects permanently (4xx other than 429) are
+        dropped; on connection errors or 5xx responses the remaining
+        collections stay buffered for the next attempt.
+        """
+        from influxdb_client.rest import ApiException
+        
+        with self.write_lock:
+            written = 0
+            dropped = 0
             
-            logger.info("Metrics written to InfluxDB successfully")
+            while self.pending_metrics:
+                timestamp, metrics = self.pending_metrics[0]
+                try:
+                    points = self.build_points(metrics, timestamp)
+                    self.get_write_api().write(
+                        bucket=self.influx_bucket,
+                        org=self.influx_org,
+                        record=points
+                    )
+                except ApiException as e:
+                    if e.status is not None and 400 <= e.status < 500 and e.status != 429:
+                        logger.error(f"InfluxDB rejected metrics from {timestamp.isoformat()}, dropping them: {e.status} {e.reason}")
+                        self.pending_metrics.popleft()
+                        dropped += 1
+                        continue
+                    logger.error(f"Failed to write metrics to InfluxDB ({len(self.pending_metrics)} collections kept): {e}")
+                    return False
+                except (KeyError, TypeError, ValueError) as e:
+                    logger.error(f"Invalid metrics from {timestamp.isoformat()}, dropping them: {e}")
+                    self.pending_metrics.popleft()
+                    dropped += 1
+                    continue
+                except Exception as e:
+                    logger.error(f"Failed to write metrics to InfluxDB ({len(self.pending_metrics)} collections kept): {e}")
+                    return False
+                
+                self.pending_metrics.popleft()
+                written += 1
             
-        except Exception as e:
-            logger.error(f"Failed to write metrics to InfluxDB: {e}")
+            if written:
+                logger.info(f"Metrics written to InfluxDB successfully ({written} collections)")
+            return dropped == 0
 
     def collect_metrics(self):
         """Collect all network metrics"""
         logger.info("Starting metrics collection...")
         
         # Perform ping tests
-        ping_results = [
-            self.ping_target(self.target1, self.target1_name),
-            self.ping_target(self.target2, self.target2_name)
-        ]
+        self.emit_progress('phase', phase='ping', status='started')
+        ping_results = []
+        for target, target_name in [(self.target1, self.target1_name), (self.target2, self.target2_name)]:
+            result = self.ping_target(target, target_name)
+            self.emit_progress('ping', **result)
+            ping_results.append(result)
+        self.emit_progress('phase', phase='ping', status='completed')
         
         # Always perform speed test for manual calls
         logger.info("Running enhanced speed test...")
@@ -440,6 +853,50 @@ class NetworkMonitor:
                 logger.error(f"Error in monitoring loop: {e}")
                 time.sleep(10)  # Wait before retrying
 
+    def run_once(self, influx_timeout=120):
+        """Run a single full collection, write it to InfluxDB and return success"""
+        logger.info("Starting single-shot network test...")
+        
+        metrics = self.collect_metrics()
+        self.emit_progress(
+            'result',
+            speed_test=metrics['speed_test'],
+            ping_results=metrics['ping_results']
+        )
+        if self.write_metrics(metrics):
+            return True
+        
+        # Probing is done; give InfluxDB time to come up, then retry the
+        # metrics that are still buffered
+        if not self.influx_ready.wait(influx_timeout):
+            logger.error(f"InfluxDB not ready after {influx_timeout} seconds, metrics discarded")
+            return False
+        
+        return self.flush_metrics()
+
 if __name__ == "__main__":
+    import sys
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Network monitoring collector")
+    parser.add_argument('--once', action='store_true',
+                        help="run a single full test (including speed test) and exit, e.g. for cron or systemd timers")
+    parser.add_argument('--progress', action='store_true',
+                        help="print machine-readable progress events to stdout")
+    parser.add_argument('--influx-timeout', type=int, default=120,
+                        help="seconds --once waits for InfluxDB before giving up (default: 120)")
+    args = parser.parse_args()
+    
     monitor = NetworkMonitor()
+    if args.progress:
+        # One write per line so log output from other threads sharing the pipe
+        # cannot split a progress line
+        def print_progress(event):
+            sys.stdout.write("PROGRESS " + json.dumps(event) + "\n")
+            sys.stdout.flush()
+        monitor.progress_callback = print_progress
+    
+    if args.once:
+        raise SystemExit(0 if monitor.run_once(args.influx_timeout) else 1)
+    
     monitor.run()
\ No newline at end of file
@@ -7,15 +7,9 @@ if [[ "$*" == *"manual-test-server.py"* ]]; then
     echo "Endpoints:"
     echo "  GET  /health      - Health check"
     echo "  POST /manual-test - Execute manual network test"
+    echo "  GET  /manual-test/<test_id>/events - Live test progress (SSE)"
     
-    # Wait for InfluxDB to be ready
-    echo "Waiting for InfluxDB to be ready..."
-    while ! curl -f -s $INFLUXDB_URL/health > /dev/null 2>&1; do
-        echo "InfluxDB not ready, waiting..."
-        sleep 5
-    done
-    
-    echo "InfluxDB is ready, starting manual test server..."
+    # The server does not need InfluxDB; test runs wait for it in the background
     exec python3 manual-test-server.py
     
 elif [[ "$*" == *"collector.py"* ]]; then
@@ -24,15 +18,10 @@ elif [[ "$*" == *"collector.py"* ]]; then
     echo "Collection interval: ${COLLECTION_INTERVAL}s"
     echo "Retention: ${RETENTION_DAYS} days"
 
-    # Wait for InfluxDB to be ready
-    echo "Waiting for InfluxDB to be ready..."
-    while ! curl -f -s $INFLUXDB_URL/health > /dev/null 2>&1; do
-        echo "InfluxDB not ready, waiting..."
-        sleep 5
-    done
-
-    echo "InfluxDB is ready, starting collector..."
-    exec python3 collector.py
+    # InfluxDB readiness is checked in the background; probing starts right away
+    # and results are buffered until InfluxDB is up. Pass the command through so
+    # options such as --once reach the collector.
+    exec "$@"
     
 else
     # Default behavior - run collector
@@ -41,13 +30,7 @@ else
     echo "Collection interval: ${COLLECTION_INTERVAL}s"
     echo "Retention: ${RETENTION_DAYS} days"
 
-    # Wait for InfluxDB to be ready
-    echo "Waiting for InfluxDB to be ready..."
-    while ! curl -f -s $INFLUXDB_URL/health > /dev/null 2>&1; do
-        echo "InfluxDB not ready, waiting..."
-        sleep 5
-    done
-
-    echo "InfluxDB is ready, starting collector..."
+    # InfluxDB readiness is checked in the background; probing starts right away
+    # and results are buffered until InfluxDB is up
     exec python3 collector.py
 fi
\ No newline at end of file
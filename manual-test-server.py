@@ -9,12 +9,85 @@ import subprocess
 import threading
 import time
 import socket
+import uuid
 from socketserver import ThreadingMixIn
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Prefix the collector subprocess uses for machine-readable progress lines
+PROGRESS_PREFIX = 'PROGRESS '
+
+# Number of finished test runs kept around for late SSE subscribers
+MAX_FINISHED_RUNS = 10
+
+# Seconds between SSE keep-alive comments while no events arrive
+SSE_KEEPALIVE_INTERVAL = 15
+
+# Time allowed for collecting a manual test's metrics. This is a generous
+# allowance, not a hard bound: the phase timeouts alone (2 x 30s pings, 20s
+# parallel download, 25s curl fallback, 2 x 15s uploads) add up to ~140s, but
+# requests timeouts apply per socket operation, the download pool waits for
+# its workers, and a 5MB upload on a slow uplink takes well over 15s. The
+# allowance roughly doubles that sum and can be raised via the environment.
+MAX_COLLECTION_SECONDS = int(os.getenv('MANUAL_TEST_COLLECTION_SECONDS', '300'))
+
+# Seconds a manual test waits for InfluxDB after collecting before giving up
+INFLUX_WAIT_SECONDS = 60
+
+# Watchdog timeout for a manual test run, leaving room to flush the results
+MANUAL_TEST_TIMEOUT = MAX_COLLECTION_SECONDS + INFLUX_WAIT_SECONDS + 10
+
+class TestRun:
+    """Progress events of a single manual test, shared with SSE subscribers"""
+    def __init__(self):
+        self.test_id = uuid.uuid4().hex[:12]
+        self.started = time.time()
+        self.events = []
+        self.finished = False
+        self.condition = threading.Condition()
+    
+    def publish(self, event):
+        with self.condition:
+            self.events.append(event)
+            self.condition.notify_all()
+    
+    def finish(self, status, **data):
+        with self.condition:
+            self.events.append({'event': 'done', 'status': status, 'timestamp': time.time(), **data})
+            self.finished = True
+            self.condition.notify_all()
+    
+    def wait_for_events(self, offset, timeout):
+        """Return events after offset, blocking up to timeout for new ones"""
+        with self.condition:
+            if offset >= len(self.events) and not self.finished:
+                self.condition.wait(timeout)
+            return self.events[offset:], self.finished
+
+test_runs = {}
+test_runs_lock = threading.Lock()
+
+def register_test_run():
+    """Create a new test run and drop the oldest finished ones"""
+    run = TestRun()
+    with test_runs_lock:
+        finished = sorted((r for r in test_runs.values() if r.finished), key=lambda r: r.started)
+        for old_run in finished[:max(0, len(finished) - MAX_FINISHED_RUNS)]:
+            del test_runs[old_run.test_id]
+        test_runs[run.test_id] = run
+    return run
+
+def get_test_run(test_id):
+    """Look up a test run; 'latest' returns the most recently started one"""
+    with test_runs_lock:
+        if test_id == 'latest':
+            if not test_runs:
+                return None
+            return max(test_runs.values(), key=lambda r: r.started)
+        return test_runs.get(test_id)
+
 class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
     """Handle requests in a separate thread."""
     daemon_threads = True
@@ -26,9 +99,12 @@ class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
 
 class ManualTestHandler(BaseHTTPRequestHandler):
     def do_GET(self):
-        """Handle GET requests for health check"""
+        """Handle GET requests for health check and progress streams"""
         try:
-            if self.path == '/health':
+            parsed_path = urlparse(self.path)
+            path_parts = parsed_path.path.strip('/').split('/')
+            
+            if parsed_path.path == '/health':
                 logger.info("Health check request received")
                 
                 self.send_response(200)
@@ -44,7 +120,8 @@ class ManualTestHandler(BaseHTTPRequestHandler):
                     'version': '1.0',
                     'endpoints': {
                         'health': '/health',
-                        'manual_test': '/manual-test'
+                        'manual_test': '/manual-test',
+                        'manual_test_events': '/manual-test/<test_id>/events'
                     }
                 }
                 
@@ -52,6 +129,9 @@ class ManualTestHandler(BaseHTTPRequestHandler):
                 self.wfile.write(response_data)
                 logger.info("Health check response sent successfully")
                 
+            elif len(path_parts) == 3 and path_parts[0] == 'manual-test' and path_parts[2] == 'events':
+                self.handle_event_stream(path_parts[1])
+                
             else:
                 self.send_error(404, "Not Found")
                 
@@ -109,6 +189,8 @@ class ManualTestHandler(BaseHTTPRequestHandler):
                 post_data = self.rfile.read(content_length)
                 logger.info(f"Received POST data: {post_data}")
             
+            run = register_test_run()
+            
             # Send immediate response
             self.send_response(200)
             self.send_header('Content-Type', 'application/json')
@@ -122,6 +204,8 @@ class ManualTestHandler(BaseHTTPRequestHandler):
                 'status': 'success',
                 'message': 'Manual test started successfully',
                 'timestamp': time.time(),
+                'test_id': run.test_id,
+                'events': f'/manual-test/{run.test_id}/events',
                 'note': 'Results will be available in InfluxDB/Grafana in ~30 seconds'
             }
             
@@ -130,7 +214,7 @@ class ManualTestHandler(BaseHTTPRequestHandler):
             logger.info("Manual test response sent, starting background test...")
             
             # Start test in background thread
-            test_thread = threading.Thread(target=self.run_test_async)
+            test_thread = threading.Thread(target=self.run_test_async, args=(run,))
             test_thread.daemon = True
             test_thread.start()
             
@@ -141,72 +225,113 @@ class ManualTestHandler(BaseHTTPRequestHandler):
             except:
                 pass
     
-    def run_test_async(self):
+    def handle_event_stream(self, test_id):
+        """Stream progress events of a manual test as Server-Sent Events"""
+        run = get_test_run(test_id)
+        if run is None:
+            self.send_error(404, "Unknown test id")
+            return
+        
+        logger.info(f"Event stream opened for test {run.test_id}")
+        
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        
+        offset = 0
+        try:
+            while True:
+                events, finished = run.wait_for_events(offset, SSE_KEEPALIVE_INTERVAL)
+                if events:
+                    for event in events:
+                        try:
+                            payload = f"event: {event.get('event', 'message')}\ndata: {json.dumps(event)}\n\n"
+                        except Exception as e:
+                            logger.warning(f"Skipping malformed event for test {run.test_id}: {e}")
+                            continue
+                        self.wfile.write(payload.encode('utf-8'))
+                    offset += len(events)
+                else:
+                    # Comment line keeps proxies from closing an idle stream
+                    self.wfile.write(b": keep-alive\n\n")
+                self.wfile.flush()
+                
+                if finished and offset >= len(run.events):
+                    break
+        except (BrokenPipeError, ConnectionResetError):
+            logger.info(f"Event stream client for test {run.test_id} disconnected")
+            return
+        except Exception as e:
+            # Headers are already sent, so send_error() would corrupt the stream
+            logger.error(f"Error in event stream for test {run.test_id}: {e}")
+            return
+        
+        logger.info(f"Event stream for test {run.test_id} completed")
+    
+    def run_test_async(self, run):
         """Run the actual test in background"""
         try:
-            logger.info("Starting background manual network test...")
+            logger.info(f"Starting background manual network test {run.test_id}...")
             
-            # Execute the collector directly
-            result = subprocess.run([
-                'python3', '-c', '''
-import sys
-sys.path.append('/app')
-from collector import NetworkMonitor
-import json
-
-try:
-    monitor = NetworkMonitor()
-    print("Starting manual test...")
-    
-    # Collect all metrics including speed test
-    metrics = monitor.collect_metrics()
-    
-    # Force speed test if not already done
-    if metrics["speed_test"]["download_speed_mbps"] == 0:
-        print("Running forced speed test...")
-        speed_test = monitor.perform_speed_test()
-        metrics["speed_test"] = speed_test
-    
-    # Write to InfluxDB
-    monitor.write_metrics(metrics)
-    
-    print("Manual test completed successfully!")
-    print(f"Download: {metrics['speed_test']['download_speed_mbps']} Mbps")
-    print(f"Upload: {metrics['speed_test']['upload_speed_mbps']} Mbps")
-    
-    for ping_result in metrics['ping_results']:
-        if ping_result['success']:
-            print(f"{ping_result['target_name']}: {ping_result['avg_rtt']}ms RTT, {ping_result['packet_loss']}% loss")
-        else:
-            print(f"{ping_result['target_name']}: FAILED")
-    
-except Exception as e:
-    print(f"Manual test failed: {e}")
-    import traceback
-    traceback.print_exc()
-'''
-            ], 
-            cwd='/app',
-            capture_output=True, 
-            text=True, 
-            timeout=120,
-            env=dict(os.environ)
+            # Run the collector in single-shot mode, streaming its output line by line
+            process = subprocess.Popen(
+                ['python3', '-u', 'collector.py', '--once', '--progress',
+                 '--influx-timeout', str(INFLUX_WAIT_SECONDS)],
+                cwd='/app',
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+                env=dict(os.environ)
             )
             
-            if result.returncode == 0:
+            # Kill the test if it exceeds the timeout
+            timed_out = threading.Event()
+            def kill_on_timeout():
+                timed_out.set()
+                process.kill()
+            watchdog = threading.Timer(MANUAL_TEST_TIMEOUT, kill_on_timeout)
+            watchdog.start()
+            
+            output_lines = []
+            try:
+                for line in process.stdout:
+                    line = line.rstrip('\n')
+                    if line.startswith(PROGRESS_PREFIX):
+                        try:
+                            event = json.loads(line[len(PROGRESS_PREFIX):])
+                        except ValueError:
+                            event = None
+                        if isinstance(event, dict):
+                            run.publish(event)
+                        else:
+                            logger.debug(f"Invalid progress line: {line}")
+                    else:
+                        output_lines.append(line)
+                process.wait()
+            finally:
+                watchdog.cancel()
+            
+            output = '\n'.join(output_lines)
+            
+            if timed_out.is_set():
+                logger.error(f"Manual test timed out after {MANUAL_TEST_TIMEOUT} seconds")
+                run.finish('timeout')
+            elif process.returncode == 0:
                 logger.info("Manual test completed successfully")
-                logger.info(f"Test output: {result.stdout}")
+                logger.info(f"Test output: {output}")
+                run.finish('success')
             else:
-                logger.error(f"Manual test failed with return code {result.returncode}")
-                logger.error(f"Error output: {result.stderr}")
-                logger.error(f"Stdout: {result.stdout}")
+                logger.error(f"Manual test failed with return code {process.returncode}")
+                logger.error(f"Test output: {output}")
+                run.finish('failed', returncode=process.returncode)
                 
-        except subprocess.TimeoutExpired:
-            logger.error("Manual test timed out after 120 seconds")
         except Exception as e:
             logger.error(f"Error running manual test: {e}")
             import traceback
             traceback.print_exc()
+            run.finish('error', message=str(e))
     
     def log_message(self, format, *args):
         """Override to use our logger"""
@@ -248,6 +373,7 @@ def run_server():
         logger.info("Available endpoints:")
         logger.info("  GET  /health      - Health check")
         logger.info("  POST /manual-test - Execute manual network test")
+        logger.info("  GET  /manual-test/<test_id>/events - Live test progress (SSE)")
         logger.info("")
         logger.info("Server is ready to accept connections")
         